@@ -0,0 +1,392 @@
+# Feed side shared by vd.py, spike.py and spike-gemini.py: configuration,
+# the shared-memory layout, Polygon message decoding, trade classification
+# and the WebSocket process, plus the UI-side views of what it publishes.
+import os
+import sys
+import math
+import time
+import struct
+from multiprocessing.shared_memory import SharedMemory
+from dataclasses import dataclass
+
+import msgspec
+from polygon import WebSocketClient
+from dotenv import load_dotenv
+
+# --- Configuration ---
+@dataclass(frozen=True, slots=True)
+class Config:
+    api_key: str
+    tickers: tuple[str, ...]  # upper-cased, de-duplicated and interned
+    # Optional CPU for the WebSocket process (Linux only), ideally one
+    # reserved with the isolcpus= boot parameter; the UI is then kept off it.
+    ws_cpu: int | None = None
+
+def load_config(argv):
+    # Built once in the parent process and handed to the worker, so a
+    # spawned worker never re-reads argv or the environment.
+    if len(argv) < 2:
+        print(f"Usage: {argv[0]} STOCK_TICKER [STOCK_TICKER ...]")
+        sys.exit(1)
+    # Load .env file if it exists, without overriding existing environment variables
+    load_dotenv()
+    return Config(
+        api_key=os.getenv('POLYGON_API_KEY', 'YOUR_API_KEY_HERE'),
+        tickers=tuple(sys.intern(ticker) for ticker in dict.fromkeys(arg.upper() for arg in argv[1:])),
+        ws_cpu=parse_ws_cpu(os.getenv('WS_CPU')),
+    )
+
+def parse_ws_cpu(value):
+    # WS_CPU is validated up front so a bad value ends in a message, not a
+    # traceback here or a worker that dies after curses has the terminal.
+    if not value:
+        return None
+    if not hasattr(os, 'sched_setaffinity'):
+        print("Error: WS_CPU is only supported on Linux.")
+        sys.exit(1)
+    try:
+        ws_cpu = int(value)
+    except ValueError:
+        print(f"Error: WS_CPU={value!r} is not a CPU number.")
+        sys.exit(1)
+    if ws_cpu not in os.sched_getaffinity(0):
+        print(f"Error: WS_CPU={ws_cpu} is not a CPU this process may run on.")
+        sys.exit(1)
+    return ws_cpu
+
+# --- Shared State Layout ---
+# The WebSocket process publishes its running totals into a small shared
+# memory block guarded by a sequence counter (seqlock): the writer bumps
+# seq to odd, writes the fields, then bumps it back to even. A reader that
+# sees an odd or changed seq around its read simply retries.
+# This is a single-producer/single-consumer handoff with no lock: the
+# writer never waits on the reader. Only cumulative totals cross it, not
+# individual trades, so a slow reader can skip updates but never lose volume.
+# Each ticker owns one SLOT_SIZE slot of the block, in config.tickers order.
+SEQ = struct.Struct('q')       # slot offset 0
+FIELDS = struct.Struct('qqd')  # slot offset 8: ask_volume, bid_volume, last_price
+SLOT_SIZE = 64
+
+# After the ticker slots comes the feed-latency histogram: one uint32
+# counter per millisecond of (receive time - SIP timestamp), the last one
+# also counting anything slower. The WebSocket process only increments
+# them; the UI diffs snapshots to get per-window percentiles.
+LATENCY_BUCKETS = 4096
+LATENCY_SIZE = LATENCY_BUCKETS * 4
+
+# Last comes a single uint64 count of the messages (or whole frames) that
+# decode_frame had to drop, so the UI can show it instead of the worker
+# printing over the screen.
+DROPPED_SIZE = 8
+
+def create_shared_block(tickers):
+    # One slot per ticker followed by the latency histogram and the dropped
+    # count. Every slot starts with zero volume and no last price.
+    shm = SharedMemory(create=True, size=SLOT_SIZE * len(tickers) + LATENCY_SIZE + DROPPED_SIZE)
+    for i in range(len(tickers)):
+        FIELDS.pack_into(shm.buf, i * SLOT_SIZE + SEQ.size, 0, 0, math.nan)
+    return shm
+
+# --- Polygon Message Types ---
+# The client runs in raw mode and frames are decoded straight into these
+# structs, skipping the generic json.loads + model-object construction.
+# Field names follow Polygon's wire format; unused fields are ignored.
+class Trade(msgspec.Struct, tag_field="ev", tag="T", frozen=True, gc=False):
+    sym: str
+    p: float  # price
+    s: int    # size
+    t: int    # SIP timestamp, Unix ms
+
+class Quote(msgspec.Struct, tag_field="ev", tag="Q", frozen=True, gc=False):
+    sym: str
+    bp: float | None = None  # bid price; absent on a one-sided quote
+    ap: float | None = None  # ask price; absent on a one-sided quote
+
+class Status(msgspec.Struct, tag_field="ev", tag="status", frozen=True, gc=False):
+    pass
+
+MESSAGE_DECODER = msgspec.json.Decoder(list[Trade | Quote | Status])
+FRAME_DECODER = msgspec.json.Decoder(list[msgspec.Raw])
+ITEM_DECODER = msgspec.json.Decoder(Trade | Quote | Status)
+
+def decode_frame(raw, dropped):
+    # Decode the whole frame in one pass. A message the structs don't describe
+    # (an unknown event, a missing or mistyped field) fails that pass for the
+    # entire frame, so then decode message by message and drop only the bad
+    # ones; one odd message must not cost the frame's trades or the connection.
+    # Each dropped message, or unparsable frame, is counted in dropped[0].
+    try:
+        return MESSAGE_DECODER.decode(raw)
+    except msgspec.DecodeError:
+        pass
+    try:
+        items = FRAME_DECODER.decode(raw)
+    except msgspec.DecodeError:
+        dropped[0] += 1
+        return ()
+    messages = []
+    for item in items:
+        try:
+            messages.append(ITEM_DECODER.decode(item))
+        except msgspec.DecodeError:
+            dropped[0] += 1
+    return messages
+
+# --- Trade Classification ---
+def classify_trades(trades, bid, ask):
+    # Split (price, size) trades into ask and bid volume against one quote:
+    # each trade goes to the side it printed nearer to, ties to the ask.
+    ask_volume = 0
+    total_volume = 0
+    for price, volume in trades:
+        total_volume += volume
+        if price - bid >= ask - price:
+            ask_volume += volume
+    return ask_volume, total_volume - ask_volume
+
+# --- Volume Delta Calculator Class ---
+class VolumeDeltaCalculator:
+    """Accumulates ask/bid volume and the last traded price for one ticker
+    in the WebSocket process.
+
+    The running totals are owned by this process alone and only ever grow;
+    publish() copies them into the shared block for the UI process.
+    """
+
+    def __init__(self, shm, offset, updated):
+        self.shm = shm
+        self.offset = offset    # start of this ticker's slot in shm
+        self.updated = updated  # Event set after every publish
+        self.seq = 0
+        self.ask_volume = 0
+        self.bid_volume = 0
+        self.latest_quote = None  # Tuple: (bid, ask)
+        self.last_price = math.nan  # Last traded price; NaN until the first trade
+
+    def flush(self, quote, trades):
+        # Apply the quote in effect for this run of (price, size) trades (None
+        # keeps the current one), then classify the whole run against it,
+        # summing locally so each counter is written once per run.
+        if quote is not None:
+            self.latest_quote = (quote.bp, quote.ap)
+        if not trades:
+            return
+        # Always update the last traded price
+        self.last_price = trades[-1][0]
+        # If we haven't received a quote yet, we skip volume delta calculations.
+        quote = self.latest_quote
+        if quote is None:
+            return
+        bid, ask = quote
+
+        ask_volume, bid_volume = classify_trades(trades, bid, ask)
+        self.ask_volume += ask_volume
+        self.bid_volume += bid_volume
+
+    def publish(self):
+        buf = self.shm.buf
+        offset = self.offset
+        self.seq += 1  # odd: write in progress
+        SEQ.pack_into(buf, offset, self.seq)
+        FIELDS.pack_into(buf, offset + SEQ.size, self.ask_volume, self.bid_volume, self.last_price)
+        self.seq += 1
+        SEQ.pack_into(buf, offset, self.seq)
+        self.updated.set()
+
+# --- UI-side View of the Shared Totals ---
+class VolumeDeltaView:
+    """Reads the totals published by VolumeDeltaCalculator.
+
+    reset() only moves this reader's baseline, so the UI never writes to the
+    shared block and cannot race the WebSocket process. All views share one
+    updated Event, so waiting on any of them wakes on every publish.
+    """
+
+    def __init__(self, shm, offset, updated):
+        self.shm = shm
+        self.offset = offset
+        self.updated = updated
+        self.baseline = (0, 0)  # (ask_volume, bid_volume) at the last reset()
+
+    def read(self):
+        buf = self.shm.buf
+        offset = self.offset
+        while True:
+            seq = SEQ.unpack_from(buf, offset)[0]
+            if seq & 1:
+                continue
+            fields = FIELDS.unpack_from(buf, offset + SEQ.size)
+            if SEQ.unpack_from(buf, offset)[0] == seq:
+                return fields
+
+    def get_snapshot(self):
+        # Volume delta and ask/bid volume since reset(), plus the last traded
+        # price (None before the first trade), all from the same publish.
+        ask_volume, bid_volume, last_price = self.read()
+        ask_base, bid_base = self.baseline
+        ask_volume -= ask_base
+        bid_volume -= bid_base
+        if math.isnan(last_price):
+            last_price = None
+        return ask_volume - bid_volume, ask_volume, bid_volume, last_price
+
+    def get_volume_delta(self):
+        return self.get_snapshot()[:3]
+
+    def get_last_price(self):
+        last_price = self.read()[2]
+        return None if math.isnan(last_price) else last_price
+
+    def wait_for_update(self, timeout):
+        # Sleep until the WebSocket process publishes or timeout passes.
+        if self.updated.wait(max(0.0, timeout)):
+            self.updated.clear()
+
+    def reset(self):
+        # The last price carries over; the spike scripts use it as a reference.
+        self.baseline = self.read()[:2]
+
+class LatencyView:
+    """Reads the feed-latency histogram and the dropped-message count filled
+    in by the WebSocket process.
+
+    Like VolumeDeltaView, reset() only moves this reader's baseline.
+    """
+
+    def __init__(self, shm, offset):
+        self.counts = shm.buf[offset:offset + LATENCY_SIZE].cast('I')
+        self.dropped = shm.buf[offset + LATENCY_SIZE:offset + LATENCY_SIZE + DROPPED_SIZE].cast('Q')
+        self.baseline = [0] * LATENCY_BUCKETS
+
+    def percentile_ms(self, percent):
+        # Smallest latency in ms covering percent of the trades seen since
+        # reset(), or None if there were none. Integer math throughout.
+        counts = [now - base for now, base in zip(self.counts.tolist(), self.baseline)]
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = -(-total * percent // 100)
+        seen = 0
+        for lag_ms, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return lag_ms
+
+    def dropped_messages(self):
+        # Messages dropped as undecodable since the feed started.
+        return self.dropped[0]
+
+    def reset(self):
+        self.baseline = self.counts.tolist()
+
+    def release(self):
+        self.counts.release()
+        self.dropped.release()
+
+# --- WebSocket Message Handler ---
+def handle_message(raw, calculators, latency, dropped):
+    # Collect consecutive trades per ticker and classify each run in a single
+    # flush. A quote for that ticker ends its run, so every trade is still
+    # matched against the quote that was in effect when it printed; quotes
+    # with no trades after them are superseded here and never reach the
+    # calculator. runs maps each calculator touched by this frame to its
+    # open [quote, trades, counted] run, counted noting a flush of earlier
+    # trades in the frame. Only a calculator that counted trades publishes:
+    # a quote alone changes nothing the UI shows, so it must not wake it.
+    # Each tracked trade also bumps the latency histogram bucket for its age
+    # on arrival.
+    now_ms = time.time_ns() // 1_000_000
+    runs = {}
+    for msg in decode_frame(raw, dropped):
+        msg_type = type(msg)
+        # Polygon already upper-cases symbols, so no per-message .upper().
+        if msg_type is Trade:
+            calculator = calculators.get(msg.sym)
+            if calculator is not None:
+                run = runs.get(calculator)
+                if run is None:
+                    run = runs[calculator] = [None, [], False]
+                run[1].append((msg.p, msg.s))
+                lag_ms = now_ms - msg.t
+                if lag_ms >= LATENCY_BUCKETS:
+                    lag_ms = LATENCY_BUCKETS - 1
+                elif lag_ms < 0:
+                    lag_ms = 0  # local clock behind the SIP clock
+                latency[lag_ms] += 1
+        elif msg_type is Quote:
+            calculator = calculators.get(msg.sym)
+            # A one-sided quote cannot split trades between bid and ask, so
+            # the last two-sided quote stays in effect.
+            if calculator is not None and msg.bp is not None and msg.ap is not None:
+                run = runs.get(calculator)
+                if run is None:
+                    runs[calculator] = [msg, [], False]
+                else:
+                    if run[1]:
+                        calculator.flush(run[0], run[1])
+                        run[1] = []
+                        run[2] = True
+                    run[0] = msg
+    for calculator, (quote, trades, counted) in runs.items():
+        calculator.flush(quote, trades)
+        if trades or counted:
+            calculator.publish()
+
+# --- WebSocket Connection with Retry ---
+def run_websocket(config, shm_name, updated, stop):
+    # Runs in its own process so trade handling never waits on the UI for
+    # the GIL. Results go out through the shared memory block named shm_name.
+    # One connection serves every ticker; frames are routed by symbol.
+    tickers = config.tickers
+    if config.ws_cpu is not None:
+        # Own one CPU and, given CAP_SYS_NICE, run ahead of normal tasks on
+        # it so market data is never queued behind the UI or other work.
+        os.sched_setaffinity(0, {config.ws_cpu})
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(20))
+        except PermissionError:
+            pass
+    shm = SharedMemory(name=shm_name)
+    calculators = {
+        ticker: VolumeDeltaCalculator(shm, i * SLOT_SIZE, updated)
+        for i, ticker in enumerate(tickers)
+    }
+    latency_offset = len(tickers) * SLOT_SIZE
+    latency = shm.buf[latency_offset:latency_offset + LATENCY_SIZE].cast('I')
+    dropped = shm.buf[latency_offset + LATENCY_SIZE:latency_offset + LATENCY_SIZE + DROPPED_SIZE].cast('Q')
+
+    # Configure retry parameters similar to ticksonic.
+    max_retries = 3
+    delay = 10  # seconds to wait before retrying
+    remaining_retries = max_retries
+
+    while not stop.is_set():
+        try:
+            client = WebSocketClient(api_key=config.api_key, raw=True)
+            client.subscribe(*(f"T.{ticker}" for ticker in tickers))
+            client.subscribe(*(f"Q.{ticker}" for ticker in tickers))
+            client.run(lambda raw: handle_message(raw, calculators, latency, dropped))
+            # If the client ends gracefully, reset retry counter:
+            print("WebSocket client ended or disconnected gracefully.")
+            remaining_retries = max_retries
+
+        except KeyboardInterrupt:
+            print("KeyboardInterrupt detected. Shutting down gracefully.")
+            break
+
+        except ConnectionResetError:
+            print(f"WebSocket connection reset by peer. Retrying in {delay} seconds...")
+            stop.wait(delay)
+
+        except Exception as e:
+            remaining_retries -= 1
+            if remaining_retries > 0:
+                print(f"WebSocket encountered an error: {e}. Retrying in {delay} seconds... (Remaining retries: {remaining_retries})")
+                stop.wait(delay)
+            else:
+                print(f"WebSocket encountered an error: {e}. No more retries left. Shutting down gracefully.")
+                break
+
+    latency.release()  # drop the exports so the block can be closed
+    dropped.release()
+    shm.close()
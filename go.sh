@@ -1,8 +1,8 @@
 #!/bin/bash
 
 if [ -z "$1" ]; then
-  echo "Usage: $0 STOCK_TICKER"
+  echo "Usage: $0 STOCK_TICKER [STOCK_TICKER ...]"
   exit 1
 fi
 
-poetry run python vd.py "$1"
+poetry run python vd.py "$@"
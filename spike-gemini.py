@@ -1,149 +1,38 @@
 #!/usr/bin/env python3
 import os
 import sys
+import shutil
 import time
-import threading
-import math
+import multiprocessing
+from collections import deque
 import curses
-from datetime import datetime
-
-from polygon import WebSocketClient
-from polygon.websocket.models import EquityTrade, EquityQuote
-from dotenv import load_dotenv
-
-# Load .env file if it exists, without overriding existing environment variables
-load_dotenv()
-
-# --- Configuration ---
-API_KEY = os.getenv('POLYGON_API_KEY', 'YOUR_API_KEY_HERE')
-if len(sys.argv) < 2:
-    print(f"Usage: {sys.argv[0]} STOCK_TICKER")
-    sys.exit(1)
-TICKER = sys.argv[1].upper()
-
-# --- Volume Delta Calculator Class ---
-class VolumeDeltaCalculator:
-    def __init__(self, ticker):
-        self.ticker = ticker.upper()
-        self.lock = threading.Lock()
-        self.ask_volume = 0
-        self.bid_volume = 0
-        self.latest_quote = None  # Dictionary holding {"bid": value, "ask": value}
-        self.last_traded_price = None  # Store the most recent trade price
-
-    def update_quote(self, quote: EquityQuote):
-        if quote.symbol.upper() != self.ticker:
-            return
-        with self.lock:
-            self.latest_quote = {"bid": quote.bid_price, "ask": quote.ask_price}
-
-    def update_trade(self, trade: EquityTrade):
-        if trade.symbol.upper() != self.ticker:
-            return
-
-        price = trade.price
-        volume = trade.size
-        EPSILON = 1e-3  # Tolerance for floating point comparison
-
-        with self.lock:
-            # Always update the last traded price even if no quote is available.
-            self.last_traded_price = price
-            # If we haven't received a quote yet, skip volume delta calculation.
-            if self.latest_quote is None:
-                return
-            bid = self.latest_quote["bid"]
-            ask = self.latest_quote["ask"]
-
-        # --- Volume assignment logic (combined from both versions) ---
-        # Use epsilon checks for exact matches first.
-        if abs(price - ask) < EPSILON:
-            with self.lock:
-                self.ask_volume += volume
-        elif abs(price - bid) < EPSILON:
-            with self.lock:
-                self.bid_volume += volume
-        # If the price is clearly above or below the quoted range.
-        elif price > ask + EPSILON:
-            with self.lock:
-                self.ask_volume += volume
-        elif price < bid - EPSILON:
-            with self.lock:
-                self.bid_volume += volume
-        else:
-            # If the price lies between the bid and ask, assign based on which is closer.
-            if abs(price - ask) < abs(price - bid):
-                with self.lock:
-                    self.ask_volume += volume
-            else:
-                with self.lock:
-                    self.bid_volume += volume
-
-    def get_volume_delta(self):
-        with self.lock:
-            delta = self.ask_volume - self.bid_volume
-            return delta, self.ask_volume, self.bid_volume
-
-    def get_last_traded_price(self):
-        with self.lock:
-            return self.last_traded_price
-
-    def reset(self):
-        with self.lock:
-            self.ask_volume = 0
-            self.bid_volume = 0
-            # Do not reset last_traded_price; we need it for spike reference
-
-# --- WebSocket Message Handler ---
-def handle_message(msgs, delta_calculator):
-    for msg in msgs:
-        if isinstance(msg, EquityTrade):
-            delta_calculator.update_trade(msg)
-        elif isinstance(msg, EquityQuote):
-            delta_calculator.update_quote(msg)
-
-# --- WebSocket Connection with Retry ---
-def run_websocket(api_key, ticker, delta_calculator):
-    max_retries = 3
-    delay = 10  # seconds to wait before retrying
-    remaining_retries = max_retries
 
-    while True:
-        try:
-            client = WebSocketClient(api_key=api_key)
-            client.subscribe(f"T.{ticker}")
-            client.subscribe(f"Q.{ticker}")
-            print(f"WebSocket connected, subscribed to T.{ticker} and Q.{ticker}")
-            client.run(lambda msgs: handle_message(msgs, delta_calculator))
-            print("WebSocket client ended or disconnected gracefully.")
-            remaining_retries = max_retries  # Reset the retry counter on graceful exit
-
-        except KeyboardInterrupt:
-            print("KeyboardInterrupt detected in WebSocket thread. Shutting down.")
-            break
+from feed import (
+    LATENCY_BUCKETS, SLOT_SIZE, LatencyView, VolumeDeltaView,
+    create_shared_block, load_config, run_websocket,
+)
 
-        except ConnectionResetError:
-            print("WebSocket connection reset by peer. Retrying in {} seconds...".format(delay))
-            time.sleep(delay)
-
-        except Exception as e:
-            remaining_retries -= 1
-            if remaining_retries > 0:
-                print(f"WebSocket error: {e}. Retrying in {delay} seconds... ({remaining_retries} retries left)")
-                time.sleep(delay)
-            else:
-                print(f"WebSocket error: {e}. No more retries left. Shutting down.")
-                break
-
-        finally:
-            if 'client' in locals() and hasattr(client, 'close') and client.ws and client.ws.connected:
-                try:
-                    client.close()
-                    print("WebSocket client closed.")
-                except Exception as close_e:
-                    print(f"Error closing WebSocket client: {close_e}")
+# --- Display Settings ---
+# Format specs for the fixed-width numeric columns, parsed once at import
+SPIKE_FMT = '>10,.0f'  # Spike display with sign, no decimals
+VOL_FMT = '>10,'       # Volume numbers
+
+# Screen layout: each ticker gets a block of MAX_LINES finalized lines plus
+# its live line, and one row below the blocks holds the latency footer.
+MAX_LINES = 4
+BLOCK_ROWS = MAX_LINES + 1
+
+def tickers_that_fit(rows):
+    # Number of ticker blocks a terminal this tall can show (at least one).
+    return max(1, (rows - 1) // BLOCK_ROWS)
+
+# Window scheduling runs on the monotonic clock in integer nanoseconds
+WINDOW_NS = 5_000_000_000       # Length of one spike window
+MIN_REDRAW_NS = 50_000_000      # Cap live redraws at 20 Hz
+KEY_POLL_NS = 200_000_000       # Longest wait between checks for the quit key
 
 # --- curses-based Main UI ---
-def curses_main(stdscr):
+def curses_main(stdscr, views, latency):
     # Configure curses settings
     curses.curs_set(0)
     stdscr.nodelay(True)
@@ -153,154 +42,213 @@ def curses_main(stdscr):
     # Color pairs: Green for positive spike, Yellow for negative
     curses.init_pair(1, curses.COLOR_GREEN, -1)
     curses.init_pair(2, curses.COLOR_YELLOW, -1)
+    # Resolved once; the attributes never change after init_pair.
+    positive_color = curses.color_pair(1)
+    negative_color = curses.color_pair(2)
+    neutral_color = curses.A_NORMAL
+
+    # Each ticker gets a block of rows (its history, then its live line).
+    # Startup refuses more tickers than fit, so only a terminal shrunk since
+    # then drops blocks here; lines name their ticker only when more than
+    # one is shown.
+    height, width = stdscr.getmaxyx()
+    tickers = list(views)[:tickers_that_fit(height)]
+    views = [views[ticker] for ticker in tickers]
+    footer_row = len(tickers) * BLOCK_ROWS  # feed latency of the last window
+    name_width = max(map(len, tickers))
+    prefixes = ["Spike" if len(tickers) == 1 else f"Spike {ticker:<{name_width}} " for ticker in tickers]
+    display_lines = [deque(maxlen=MAX_LINES) for _ in tickers]  # Per ticker: (line_string, color_attribute) tuples
+
+    def measure(view, spike_reference):
+        # Counters, spike and color of one ticker, shared by the live and
+        # finalized lines.
+        volume_delta, ask_vol, bid_vol, current_price = view.get_snapshot()
+
+        if spike_reference is not None and current_price is not None:
+            spike_value = (current_price - spike_reference) / spike_reference * abs(volume_delta)
+        else:
+            spike_value = 0.0
 
-    delta_calculator = VolumeDeltaCalculator(TICKER)
-    ws_thread = threading.Thread(target=run_websocket, args=(API_KEY, TICKER, delta_calculator), daemon=True)
-    ws_thread.start()
+        # Determine color based on the sign of the spike.
+        if spike_value > 1e-9:
+            color_attr = positive_color  # Green for positive spike
+        elif spike_value < -1e-9:
+            color_attr = negative_color  # Yellow for negative spike
+        else:
+            color_attr = neutral_color
+        return volume_delta, ask_vol, bid_vol, spike_value, color_attr
 
-    spike_field_width = 10  # Field width for spike display with sign and decimals
-    volume_field_width = 10  # Field widths for volume numbers
-    max_lines = 4  # Maximum number of historical lines to display
-    display_lines = []  # List to store (line_string, color_attribute) tuples
+    def format_line(prefix, volume_delta, ask_vol, bid_vol, spike_value):
+        # Format the columns with fixed widths.
+        return (f"{prefix}{format(spike_value, SPIKE_FMT)} | Buy:{format(ask_vol, VOL_FMT)}"
+                f" | Sell:{format(bid_vol, VOL_FMT)} | VD:{format(volume_delta, VOL_FMT)}")
 
-    # --- Get Initial Price ---
+    # --- Get Initial Prices ---
     print("Waiting for initial market data...")
-    initial_price = None
+    initial_prices = [None] * len(views)
     for _ in range(10):  # Wait up to ~2 seconds
-        initial_price = delta_calculator.get_last_traded_price()
-        if initial_price is not None:
+        initial_prices = [view.get_last_price() for view in views]
+        if None not in initial_prices:
             break
         time.sleep(0.2)
-    if initial_price is None:
-        print(f"Warning: Could not get initial price for {TICKER}. Spike calculations may be delayed.")
-    previous_window_close = initial_price
-
-    # Align the start time to the next 5-second boundary
-    now = time.time()
-    start_time = math.ceil(now / 5.0) * 5.0
-    if start_time - now > 0:
-        time.sleep(start_time - now)
+    for ticker, initial_price in zip(tickers, initial_prices):
+        if initial_price is None:
+            print(f"Warning: Could not get initial price for {ticker}. Spike calculations may be delayed.")
+    previous_window_closes = initial_prices
+    footer = ""  # Feed latency of the last finished window
+
+    # Align the start time to the next 5-second boundary. The wall clock is
+    # read once to find it; windows then run on the monotonic clock in
+    # integer nanoseconds, so clock steps and float rounding cannot skew them.
+    now_wall_ns = time.time_ns()
+    now_ns = time.monotonic_ns()
+    start_wall_ns = (now_wall_ns + WINDOW_NS - 1) // WINDOW_NS * WINDOW_NS
+    start_ns = now_ns + (start_wall_ns - now_wall_ns)
+    time.sleep(max(0, start_ns - time.monotonic_ns()) / 1e9)
 
     # --- Main Loop (each iteration is a 5-second window) ---
     while True:
-        window_time_str = datetime.fromtimestamp(start_time).strftime("%H:%M:%S")
-        end_time = start_time + 5.0
-
-        # Capture the price at the start of the window for spike reference.
-        current_window_start_price = delta_calculator.get_last_traded_price()
-        if current_window_start_price is not None:
-            previous_window_close = current_window_start_price
-
-        # Reset volume counters for the new window.
-        delta_calculator.reset()
-
-        current_update_str = ""
-        current_color_attr = curses.A_NORMAL
+        # The wall-clock stamp is only used for the window label; the UTC
+        # offset is read every window so DST changes apply at once in any zone.
+        start_s = start_wall_ns // 1_000_000_000
+        local_s = start_s + time.localtime(start_s).tm_gmtoff
+        hours, rest = divmod(local_s % 86400, 3600)
+        minutes, seconds = divmod(rest, 60)
+        window_time_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+        end_ns = start_ns + WINDOW_NS
+        # Each ticker's line prefix is fixed for the whole window.
+        line_prefixes = [f"{prefix}({window_time_str}):" for prefix in prefixes]
+
+        spike_references = []
+        for i, view in enumerate(views):
+            # Capture the price at the start of the window for spike reference.
+            current_window_start_price = view.get_last_price()
+            if current_window_start_price is not None:
+                previous_window_closes[i] = current_window_start_price
+            # Checked once per window: a missing or zero reference disables the
+            # spike. Prices come from finite trades, so the division cannot
+            # produce NaN and needs no exception guard.
+            spike_references.append(previous_window_closes[i] if previous_window_closes[i] else None)
+
+            # Reset volume counters for the new window.
+            view.reset()
+
+        last_renders = [None] * len(views)  # Values behind each live line currently on screen
+
+        # Display previous finalized lines once per window; only the live
+        # lines below them are repainted by the loop that follows.
+        height, width = stdscr.getmaxyx()
+        stdscr.erase()
+        for i, lines in enumerate(display_lines):
+            for j, (line, col) in enumerate(lines):
+                try:
+                    stdscr.addstr(i * BLOCK_ROWS + j, 0, line.ljust(width)[:width-1], col)
+                except curses.error:
+                    pass
+        try:
+            stdscr.addstr(footer_row, 0, footer[:width-1])
+        except curses.error:
+            pass
+        # Stage the history without a terminal write; the first live draw
+        # below flushes it together with the live lines in one doupdate().
+        stdscr.noutrefresh()
 
         # --- Live Update Loop Within the 5-Second Window ---
-        while time.time() < end_time:
+        # Sleep until the WebSocket process publishes (waking at least every
+        # KEY_POLL_NS for the quit key) and redraw at most 20 times/sec.
+        while time.monotonic_ns() < end_ns:
             height, width = stdscr.getmaxyx()
 
-            volume_delta, ask_vol, bid_vol = delta_calculator.get_volume_delta()
-            current_price = delta_calculator.get_last_traded_price()
+            drawn = False
+            for i, view in enumerate(views):
+                volume_delta, ask_vol, bid_vol, spike_value, current_color_attr = measure(view, spike_references[i])
 
-            spike_value = 0.0
-            if previous_window_close and current_price is not None and previous_window_close != 0:
-                try:
-                    price_delta = current_price - previous_window_close
-                    price_delta_percent = price_delta / previous_window_close
-                    spike_value = price_delta_percent * abs(volume_delta)
-                    if math.isnan(spike_value):
-                        spike_value = 0.0
-                except ZeroDivisionError:
-                    spike_value = 0.0
-                except Exception:
-                    spike_value = 0.0
-
-            # Determine color based on the sign of the spike.
-            if spike_value > 1e-9:
-                current_color_attr = curses.color_pair(1)  # Green for positive spike
-            elif spike_value < -1e-9:
-                current_color_attr = curses.color_pair(2)  # Yellow for negative spike
-            else:
-                current_color_attr = curses.A_NORMAL
-
-            # Format the columns with fixed widths.
-            raw_spike = f"{spike_value:>{spike_field_width},.0f}"
-            raw_ask   = f"{ask_vol:>{volume_field_width},}"
-            raw_bid   = f"{bid_vol:>{volume_field_width},}"
-            raw_delta = f"{volume_delta:>{volume_field_width},}"
-
-            current_update_str = f"Spike({window_time_str}):{raw_spike} | Buy:{raw_ask} | Sell:{raw_bid} | VD:{raw_delta}"
-
-            stdscr.erase()
-            # Display previous finalized lines.
-            start_row = max(0, len(display_lines) - max_lines)
-            for i, (line, col) in enumerate(display_lines[start_row:]):
+                # Skip the redraw when nothing visible changed; the spike is keyed
+                # on its displayed (rounded) value so sub-unit jitter is ignored.
+                render = (ask_vol, bid_vol, round(spike_value), current_color_attr, width)
+                if render == last_renders[i]:
+                    continue
+                last_renders[i] = render
+
+                current_update_str = format_line(line_prefixes[i], volume_delta, ask_vol, bid_vol, spike_value)
+
+                # Display current live update.
+                live_row = i * BLOCK_ROWS + len(display_lines[i])
                 try:
-                    stdscr.addstr(i, 0, line.ljust(width)[:width-1], col)
+                    stdscr.move(live_row, 0)
+                    stdscr.clrtoeol()
+                    stdscr.addstr(live_row, 0, current_update_str[:width-1], current_color_attr)
                 except curses.error:
                     pass
-            # Display current live update.
-            try:
-                stdscr.addstr(len(display_lines), 0, current_update_str.ljust(width)[:width-1], current_color_attr)
-            except curses.error:
-                pass
-            stdscr.refresh()
+                drawn = True
+            if drawn:
+                stdscr.noutrefresh()
+                curses.doupdate()
+            # Every pass counts against the 20 Hz cap, drawn or not, so a
+            # burst of publishes that change nothing cannot spin the loop.
+            next_draw_ns = time.monotonic_ns() + MIN_REDRAW_NS
 
             # Check for user input (e.g., press 'q' to quit)
             if stdscr.getch() == ord('q'):
                 return
 
-            time.sleep(0.2)
+            # All views share one updated Event, so any of them can wait.
+            views[0].wait_for_update(min(end_ns - time.monotonic_ns(), KEY_POLL_NS) / 1e9)
+            time.sleep(max(0, min(next_draw_ns, end_ns) - time.monotonic_ns()) / 1e9)
 
         # --- End-of-Window Final Calculation ---
-        volume_delta, ask_vol, bid_vol = delta_calculator.get_volume_delta()
-        current_price = delta_calculator.get_last_traded_price()
-
-        spike_value = 0.0
-        if previous_window_close and current_price is not None and previous_window_close != 0:
-            try:
-                price_delta = current_price - previous_window_close
-                price_delta_percent = price_delta / previous_window_close
-                spike_value = price_delta_percent * abs(volume_delta)
-                if math.isnan(spike_value):
-                    spike_value = 0.0
-            except ZeroDivisionError:
-                spike_value = 0.0
-            except Exception:
-                spike_value = 0.0
-
-        final_color_attr = curses.A_NORMAL
-        if spike_value > 1e-9:
-            final_color_attr = curses.color_pair(1)
-        elif spike_value < -1e-9:
-            final_color_attr = curses.color_pair(2)
+        for i, view in enumerate(views):
+            volume_delta, ask_vol, bid_vol, spike_value, final_color_attr = measure(view, spike_references[i])
+            final_str = format_line(line_prefixes[i], volume_delta, ask_vol, bid_vol, spike_value)
 
-        raw_spike = f"{spike_value:>{spike_field_width},.0f}"
-        raw_ask   = f"{ask_vol:>{volume_field_width},}"
-        raw_bid   = f"{bid_vol:>{volume_field_width},}"
-        raw_delta = f"{volume_delta:>{volume_field_width},}"
-        final_str = f"Spike({window_time_str}):{raw_spike} | Buy:{raw_ask} | Sell:{raw_bid} | VD:{raw_delta}"
+            display_lines[i].append((final_str, final_color_attr))
 
-        display_lines.append((final_str, final_color_attr))
-        if len(display_lines) > max_lines + 1:
-            display_lines.pop(0)
+        # Feed latency over the window that just ended.
+        p99 = latency.percentile_ms(99)
+        latency.reset()
+        if p99 is None:
+            footer = "Feed latency p99: n/a"
+        else:
+            footer = f"Feed latency p99: {'>=' if p99 == LATENCY_BUCKETS - 1 else ''}{p99:,} ms"
+        dropped = latency.dropped_messages()
+        if dropped:
+            footer += f"  |  Dropped messages: {dropped:,}"
 
         # Prepare start time for the next window.
-        start_time = end_time
-        now = time.time()
-        sleep_time = start_time - now
-        if sleep_time > 0:
-            time.sleep(sleep_time)
+        start_ns = end_ns
+        start_wall_ns += WINDOW_NS
+        sleep_ns = start_ns - time.monotonic_ns()
+        if sleep_ns > 0:
+            time.sleep(sleep_ns / 1e9)
 
 if __name__ == "__main__":
-    if API_KEY == 'YOUR_API_KEY_HERE' or not API_KEY:
+    config = load_config(sys.argv)
+
+    if config.api_key == 'YOUR_API_KEY_HERE' or not config.api_key:
         print("Error: POLYGON_API_KEY environment variable not set.")
         sys.exit(1)
 
+    # Every ticker is subscribed and counted, so refuse to watch more than
+    # the terminal can show rather than drop some from the screen unseen.
+    fit = tickers_that_fit(shutil.get_terminal_size().lines)
+    if len(config.tickers) > fit:
+        print(f"Error: this terminal has room for {fit} ticker(s) ({BLOCK_ROWS} rows each plus a footer), "
+              f"not {len(config.tickers)}; enlarge it or watch fewer tickers.")
+        sys.exit(1)
+
+    # Start the WebSocket process before curses takes over the terminal.
+    shm = create_shared_block(config.tickers)
+    stop = multiprocessing.Event()
+    updated = multiprocessing.Event()
+    ws_process = multiprocessing.Process(target=run_websocket, args=(config, shm.name, updated, stop), daemon=True)
+    ws_process.start()
+    if config.ws_cpu is not None and os.sched_getaffinity(0) - {config.ws_cpu}:
+        os.sched_setaffinity(0, os.sched_getaffinity(0) - {config.ws_cpu})
+    views = {ticker: VolumeDeltaView(shm, i * SLOT_SIZE, updated) for i, ticker in enumerate(config.tickers)}
+    latency = LatencyView(shm, len(config.tickers) * SLOT_SIZE)
+
     try:
-        curses.wrapper(curses_main)
+        curses.wrapper(curses_main, views, latency)
     except KeyboardInterrupt:
         curses.endwin()
         print("\nProgram terminated by user (KeyboardInterrupt).")
@@ -314,3 +262,10 @@ if __name__ == "__main__":
             curses.endwin()
         except:
             pass
+        stop.set()
+        ws_process.join(timeout=1)
+        if ws_process.is_alive():
+            ws_process.terminate()
+        latency.release()
+        shm.close()
+        shm.unlink()
@@ -1,131 +1,37 @@
 #!/usr/bin/env python3
 import os
 import sys
+import shutil
 import time
-import threading
-from datetime import datetime
+import multiprocessing
+from collections import deque
 import curses
 
-from polygon import WebSocketClient
-from polygon.websocket.models import EquityTrade, EquityQuote
-from dotenv import load_dotenv
+from feed import (
+    LATENCY_BUCKETS, SLOT_SIZE, LatencyView, VolumeDeltaView,
+    create_shared_block, load_config, run_websocket,
+)
 
-# Load .env file if it exists, without overriding existing environment variables
-load_dotenv()
+# --- Display Settings ---
+# Format specs for the fixed-width (10) numeric columns, parsed once here
+SPIKE_FMT = '>10,.0f'
+VOL_FMT = '>10,'
 
-# --- Configuration ---
-API_KEY = os.getenv('POLYGON_API_KEY', 'YOUR_API_KEY_HERE')
-if len(sys.argv) < 2:
-    print(f"Usage: {sys.argv[0]} STOCK_TICKER")
-    sys.exit(1)
-TICKER = sys.argv[1].upper()
+# Screen layout: each ticker gets a block of MAX_LINES finalized lines plus
+# its live line, and one row below the blocks holds the latency footer.
+MAX_LINES = 4
+BLOCK_ROWS = MAX_LINES + 1
 
-# --- Volume Delta Calculator Class ---
-class VolumeDeltaCalculator:
-    def __init__(self, ticker):
-        self.ticker = ticker.upper()
-        self.lock = threading.Lock()
-        self.ask_volume = 0
-        self.bid_volume = 0
-        self.latest_quote = None  # Dict: {"bid": value, "ask": value}
-        self.last_price = None    # New attribute for the last traded price
+def tickers_that_fit(rows):
+    # Number of ticker blocks a terminal this tall can show (at least one).
+    return max(1, (rows - 1) // BLOCK_ROWS)
 
-    def update_quote(self, quote):
-        if quote.symbol.upper() != self.ticker:
-            return
-        with self.lock:
-            self.latest_quote = {"bid": quote.bid_price, "ask": quote.ask_price}
-
-    def update_trade(self, trade):
-        if trade.symbol.upper() != self.ticker:
-            return
-        with self.lock:
-            # Always update the last traded price
-            self.last_price = trade.price
-            # If we haven't received a quote yet, we skip volume delta calculations.
-            if self.latest_quote is None:
-                return
-            bid = self.latest_quote["bid"]
-            ask = self.latest_quote["ask"]
-
-        price = trade.price
-        volume = trade.size
-        EPSILON = 1e-3
-
-        if abs(price - ask) < EPSILON:
-            with self.lock:
-                self.ask_volume += volume
-        elif abs(price - bid) < EPSILON:
-            with self.lock:
-                self.bid_volume += volume
-        elif price > (ask + EPSILON):
-            with self.lock:
-                self.ask_volume += volume
-        elif price < (bid - EPSILON):
-            with self.lock:
-                self.bid_volume += volume
-        else:
-            if abs(price - ask) < abs(price - bid):
-                with self.lock:
-                    self.ask_volume += volume
-            else:
-                with self.lock:
-                    self.bid_volume += volume
-
-    def get_volume_delta(self):
-        with self.lock:
-            delta = self.ask_volume - self.bid_volume
-            return delta, self.ask_volume, self.bid_volume
-
-    def get_last_price(self):
-        with self.lock:
-            return self.last_price
-
-    def reset(self):
-        with self.lock:
-            self.ask_volume = 0
-            self.bid_volume = 0
-
-# --- WebSocket Message Handler ---
-def handle_message(msgs, delta_calculator):
-    for msg in msgs:
-        if isinstance(msg, EquityTrade):
-            delta_calculator.update_trade(msg)
-        elif isinstance(msg, EquityQuote):
-            delta_calculator.update_quote(msg)
-
-# --- WebSocket Connection with Retry ---
-def run_websocket(api_key, ticker, delta_calculator):
-    # Configure retry parameters similar to ticksonic.
-    max_retries = 3
-    delay = 10  # seconds to wait before retrying
-    remaining_retries = max_retries
-
-    while True:
-        try:
-            client = WebSocketClient(api_key=api_key)
-            client.subscribe(f"T.{ticker}")
-            client.subscribe(f"Q.{ticker}")
-            client.run(lambda msgs: handle_message(msgs, delta_calculator))
-            # If the client ends gracefully, reset retry counter:
-            print("WebSocket client ended or disconnected gracefully.")
-            remaining_retries = max_retries
-
-        except KeyboardInterrupt:
-            print("KeyboardInterrupt detected. Shutting down gracefully.")
-            break
-
-        except Exception as e:
-            remaining_retries -= 1
-            if remaining_retries > 0:
-                print(f"WebSocket encountered an error: {e}. Retrying in {delay} seconds... (Remaining retries: {remaining_retries})")
-                time.sleep(delay)
-            else:
-                print(f"WebSocket encountered an error: {e}. No more retries left. Shutting down gracefully.")
-                break
+# Window scheduling runs on the monotonic clock in integer nanoseconds
+WINDOW_NS = 5_000_000_000      # length of one volume delta window
+MIN_REDRAW_NS = 50_000_000     # cap live redraws at 20 Hz
 
 # --- curses-based Main UI with updated columns for spike and volume delta ---
-def curses_main(stdscr):
+def curses_main(stdscr, views, latency):
     # Configure curses
     curses.curs_set(0)
     stdscr.nodelay(True)
@@ -135,122 +41,181 @@ def curses_main(stdscr):
     # Define color pairs: pair 1 for positive (green), pair 2 for negative (yellow)
     curses.init_pair(1, curses.COLOR_GREEN, -1)
     curses.init_pair(2, curses.COLOR_YELLOW, -1)
-
-    delta_calculator = VolumeDeltaCalculator(TICKER)
-    ws_thread = threading.Thread(target=run_websocket, args=(API_KEY, TICKER, delta_calculator), daemon=True)
-    ws_thread.start()
-
-    field_width = 10  # fixed field width for each numeric column
-    max_lines = 4     # maximum number of finalized lines to display
-
-    # This list holds finalized output tuples: (line, color)
-    display_lines = []
+    # Resolved once; the attributes never change after init_pair.
+    positive_color = curses.color_pair(1)
+    negative_color = curses.color_pair(2)
+    neutral_color = curses.A_NORMAL
 
     # Get terminal dimensions
     height, width = stdscr.getmaxyx()
 
-    # Initial alignment: wait until the next multiple of 5 seconds.
-    now = time.time()
-    if now % 5 != 0:
-        start_time = ((int(now) // 5) + 1) * 5
-        time.sleep(start_time - now)
-    else:
-        start_time = now
-
-    # Main loop: each iteration covers one 5-second window.
-    while True:
-        window_time_str = datetime.fromtimestamp(start_time).strftime("(%M:%S)")
-        end_time = start_time + 5
-
-        # Capture the "previous close" at the beginning of the window.
-        previous_close = delta_calculator.get_last_price()
-
-        current_update = ""  # live update for the current window
-        current_color = curses.A_NORMAL
-
-        # Live update loop until window ends.
-        while time.time() < end_time:
-            volume_delta, ask_vol, bid_vol = delta_calculator.get_volume_delta()
-            current_price = delta_calculator.get_last_price()
-
-            # Calculate the spike using the previous close.
-            # If previous_close or current_price is None or zero, default spike to 0.
-            if previous_close is None or previous_close == 0 or current_price is None:
-                spike = 0
-            else:
-                percent_change = (current_price - previous_close) / previous_close
-                spike = percent_change * abs(volume_delta)
-
-            # Choose color based on spike (positive green, negative yellow).
-            if spike > 0:
-                current_color = curses.color_pair(1)
-            elif spike < 0:
-                current_color = curses.color_pair(2)
-            else:
-                current_color = curses.A_NORMAL
-
-            # Format each numeric column with a fixed width.
-            spk_str   = f"{spike:>{field_width},.0f}"
-            raw_ask   = f"{ask_vol:>{field_width},}"
-            raw_bid   = f"{bid_vol:>{field_width},}"
-            raw_delta = f"{volume_delta:>{field_width},}"
-
-            # Build the live update string:
-            # "spk" column shows the spike computed from price move,
-            # followed by the Buy and Sell volumes,
-            # and a new rightmost column displays the raw volume delta.
-            current_update = (f"spk {window_time_str}:{spk_str}  |  Buy:{raw_ask}  |  Sell:{raw_bid}  | VD:{raw_delta}")
-            stdscr.erase()
-            # Draw each previously finalized line with its stored color.
-            for idx, (line, col) in enumerate(display_lines):
-                stdscr.addstr(idx, 0, line.ljust(width), col)
-            # Draw the current live update on the line after the stored lines.
-            stdscr.addstr(len(display_lines), 0, current_update.ljust(width), current_color)
-            stdscr.refresh()
-            time.sleep(0.2)
-
-        # End of window: finalize the line.
-        volume_delta, ask_vol, bid_vol = delta_calculator.get_volume_delta()
-        current_price = delta_calculator.get_last_price()
+    # Each ticker gets a block of rows: its finalized lines followed by its
+    # live line. Startup refuses more tickers than fit, so only a terminal
+    # shrunk since then drops blocks here. Lines name their ticker only when
+    # there is more than one.
+    tickers = list(views)[:tickers_that_fit(height)]
+    views = [views[ticker] for ticker in tickers]
+    footer_row = len(tickers) * BLOCK_ROWS  # feed latency of the last window
+    name_width = max(map(len, tickers))
+    # With several tickers the ticker replaces the "spk" tag, which keeps a
+    # row of four-letter tickers within 80 columns.
+    prefixes = ["spk" if len(tickers) == 1 else f"{ticker:<{name_width}}" for ticker in tickers]
+
+    # Finalized output tuples per ticker: (line, color)
+    display_lines = [deque(maxlen=MAX_LINES) for _ in tickers]
+
+    def measure(view, previous_close):
+        # Counters, spike and color of one ticker, shared by the live and
+        # finalized lines.
+        volume_delta, ask_vol, bid_vol, current_price = view.get_snapshot()
+
+        # Calculate the spike using the previous close.
+        # If previous_close or current_price is None or zero, default spike to 0.
         if previous_close is None or previous_close == 0 or current_price is None:
             spike = 0
         else:
             percent_change = (current_price - previous_close) / previous_close
             spike = percent_change * abs(volume_delta)
 
+        # Choose color based on spike (positive green, negative yellow).
         if spike > 0:
-            final_color = curses.color_pair(1)
+            color = positive_color
         elif spike < 0:
-            final_color = curses.color_pair(2)
+            color = negative_color
         else:
-            final_color = curses.A_NORMAL
+            color = neutral_color
+        return volume_delta, ask_vol, bid_vol, spike, color
+
+    def format_line(prefix, volume_delta, ask_vol, bid_vol, spike):
+        # "spk" column shows the spike computed from price move,
+        # followed by the Buy and Sell volumes,
+        # and a new rightmost column displays the raw volume delta.
+        return (f"{prefix}{format(spike, SPIKE_FMT)}"
+                f"  |  Buy:{format(ask_vol, VOL_FMT)}  |  Sell:{format(bid_vol, VOL_FMT)}"
+                f"  | VD:{format(volume_delta, VOL_FMT)}")
+
+    # Initial alignment: wait until the next multiple of 5 seconds. The wall
+    # clock is read once to find that boundary; from then on windows are
+    # scheduled on the monotonic clock, which NTP steps cannot move.
+    now_wall_ns = time.time_ns()
+    now_ns = time.monotonic_ns()
+    start_wall_ns = (now_wall_ns + WINDOW_NS - 1) // WINDOW_NS * WINDOW_NS
+    start_ns = now_ns + (start_wall_ns - now_wall_ns)
+    time.sleep(max(0, start_ns - time.monotonic_ns()) / 1e9)
 
-        spk_str   = f"{spike:>{field_width},.0f}"
-        raw_ask   = f"{ask_vol:>{field_width},}"
-        raw_bid   = f"{bid_vol:>{field_width},}"
-        raw_delta = f"{volume_delta:>{field_width},}"
-        final_str = (f"spk {window_time_str}:{spk_str}  |  Buy:{raw_ask}  |  Sell:{raw_bid}  | VD:{raw_delta}")
-        # Append the finalized string and its color.
-        display_lines.append((final_str, final_color))
-        if len(display_lines) > max_lines:
-            display_lines.pop(0)
-        delta_calculator.reset()
+    # Main loop: each iteration covers one 5-second window.
+    while True:
+        # The wall-clock stamp is only used for the window label; the UTC
+        # offset is read every window so DST changes apply at once in any zone.
+        start_s = start_wall_ns // 1_000_000_000
+        local_s = start_s + time.localtime(start_s).tm_gmtoff
+        minutes, seconds = divmod(local_s % 3600, 60)
+        window_time_str = f"({minutes:02d}:{seconds:02d})"
+        end_ns = start_ns + WINDOW_NS
+        # Each ticker's line prefix is fixed for the whole window.
+        line_prefixes = [f"{prefix} {window_time_str}:" for prefix in prefixes]
+
+        # Capture each ticker's "previous close" at the beginning of the window.
+        previous_closes = [view.get_last_price() for view in views]
+
+        last_renders = [None] * len(views)  # values behind each live line on screen
+
+        # Live update loop until window ends. Instead of polling, sleep until
+        # the WebSocket process publishes, redrawing at most 20 times a second.
+        while time.monotonic_ns() < end_ns:
+            drawn = False
+            for i, view in enumerate(views):
+                volume_delta, ask_vol, bid_vol, spike, current_color = measure(view, previous_closes[i])
+
+                # Skip the redraw when nothing visible changed. The spike is keyed
+                # on its displayed (rounded) value so sub-unit jitter is ignored.
+                render = (ask_vol, bid_vol, round(spike), current_color)
+                if render == last_renders[i]:
+                    continue
+                last_renders[i] = render
+
+                current_update = format_line(line_prefixes[i], volume_delta, ask_vol, bid_vol, spike)
+                # Only the live lines change within a window; the finalized
+                # lines above them are redrawn once per window below.
+                live_row = i * BLOCK_ROWS + len(display_lines[i])
+                stdscr.move(live_row, 0)
+                stdscr.clrtoeol()
+                stdscr.addstr(live_row, 0, current_update[:width-1], current_color)
+                drawn = True
+            if drawn:
+                stdscr.noutrefresh()
+                curses.doupdate()
+            # Every pass counts against the 20 Hz cap, drawn or not, so a
+            # burst of publishes that change nothing cannot spin the loop.
+            next_draw_ns = time.monotonic_ns() + MIN_REDRAW_NS
+            views[0].wait_for_update((end_ns - time.monotonic_ns()) / 1e9)
+            time.sleep(max(0, min(next_draw_ns, end_ns) - time.monotonic_ns()) / 1e9)
+
+        # End of window: finalize each ticker's line.
+        for i, view in enumerate(views):
+            volume_delta, ask_vol, bid_vol, spike, final_color = measure(view, previous_closes[i])
+            final_str = format_line(line_prefixes[i], volume_delta, ask_vol, bid_vol, spike)
+            # Append the finalized string and its color.
+            display_lines[i].append((final_str, final_color))
+            view.reset()
+
+        # Feed latency over the window that just ended.
+        p99 = latency.percentile_ms(99)
+        latency.reset()
+        if p99 is None:
+            footer = "feed latency p99: n/a"
+        else:
+            footer = f"feed latency p99: {'>=' if p99 == LATENCY_BUCKETS - 1 else ''}{p99:,} ms"
+        dropped = latency.dropped_messages()
+        if dropped:
+            footer += f"  |  dropped messages: {dropped:,}"
 
-        # Redraw the finalized lines.
+        # Redraw the finalized lines and the footer.
         stdscr.erase()
-        for idx, (line, col) in enumerate(display_lines):
-            stdscr.addstr(idx, 0, line.ljust(width), col)
-        stdscr.refresh()
+        for i, lines in enumerate(display_lines):
+            for idx, (line, col) in enumerate(lines):
+                stdscr.addstr(i * BLOCK_ROWS + idx, 0, line.ljust(width)[:width-1], col)
+        stdscr.addstr(footer_row, 0, footer[:width-1])
+        # Stage the history without a terminal write; the next window's first
+        # live draw flushes it together with the live lines in one doupdate().
+        stdscr.noutrefresh()
 
         # Set the next window's start time.
-        start_time = end_time
-        now = time.time()
-        if now < start_time:
-            time.sleep(start_time - now)
+        start_ns = end_ns
+        start_wall_ns += WINDOW_NS
+        time.sleep(max(0, start_ns - time.monotonic_ns()) / 1e9)
 
 if __name__ == "__main__":
+    config = load_config(sys.argv)
+
+    # Every ticker is subscribed and counted, so refuse to watch more than
+    # the terminal can show rather than drop some from the screen unseen.
+    fit = tickers_that_fit(shutil.get_terminal_size().lines)
+    if len(config.tickers) > fit:
+        print(f"Error: this terminal has room for {fit} ticker(s) ({BLOCK_ROWS} rows each plus a footer), "
+              f"not {len(config.tickers)}; enlarge it or watch fewer tickers.")
+        sys.exit(1)
+
+    # Start the WebSocket process before curses takes over the terminal.
+    shm = create_shared_block(config.tickers)
+    stop = multiprocessing.Event()
+    updated = multiprocessing.Event()
+    ws_process = multiprocessing.Process(target=run_websocket, args=(config, shm.name, updated, stop), daemon=True)
+    ws_process.start()
+    if config.ws_cpu is not None and os.sched_getaffinity(0) - {config.ws_cpu}:
+        os.sched_setaffinity(0, os.sched_getaffinity(0) - {config.ws_cpu})
+    views = {ticker: VolumeDeltaView(shm, i * SLOT_SIZE, updated) for i, ticker in enumerate(config.tickers)}
+    latency = LatencyView(shm, len(config.tickers) * SLOT_SIZE)
     try:
-        curses.wrapper(curses_main)
+        curses.wrapper(curses_main, views, latency)
     except KeyboardInterrupt:
         curses.endwin()
         print("\nProgram terminated by user.")
+    finally:
+        stop.set()
+        ws_process.join(timeout=1)
+        if ws_process.is_alive():
+            ws_process.terminate()
+        latency.release()
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,77 @@
+"""Parity of classify_trades with the per-trade EPSILON ladder it replaced.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+import pathlib
+import sys
+import unittest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from feed import classify_trades
+
+
+def old_side(price, bid, ask):
+    # The classifier VolumeDeltaCalculator.update_trade used before.
+    EPSILON = 1e-3
+    if abs(price - ask) < EPSILON:
+        return "ask"
+    elif abs(price - bid) < EPSILON:
+        return "bid"
+    elif price > (ask + EPSILON):
+        return "ask"
+    elif price < (bid - EPSILON):
+        return "bid"
+    elif abs(price - ask) < abs(price - bid):
+        return "ask"
+    else:
+        return "bid"
+
+
+# (price, bid, ask, side): one case per branch of the old ladder, on which
+# both classifiers agree.
+SAME = [
+    (10.5, 10.0, 10.5, "ask"),     # at the ask
+    (10.0, 10.0, 10.5, "bid"),     # at the bid
+    (10.75, 10.0, 10.5, "ask"),    # above the ask
+    (9.75, 10.0, 10.5, "bid"),     # below the bid
+    (10.375, 10.0, 10.5, "ask"),   # inside, nearer the ask
+    (10.125, 10.0, 10.5, "bid"),   # inside, nearer the bid
+    (10.01, 10.0, 10.01, "ask"),   # penny spread, at the ask
+    (10.0, 10.0, 10.01, "bid"),    # penny spread, at the bid
+]
+
+# (price, bid, ask, old side, new side): where the behaviour changed.
+CHANGED = [
+    (10.25, 10.0, 10.5, "bid", "ask"),    # exact midpoint
+    (0.5004, 0.5, 0.501, "ask", "bid"),   # sub-penny spread: within EPSILON of the ask, nearer the bid
+    (0.501, 0.5, 0.5, "bid", "ask"),      # exactly EPSILON above a locked quote
+]
+
+
+class ClassifyTradesTest(unittest.TestCase):
+    def side(self, price, bid, ask):
+        ask_volume, bid_volume = classify_trades(((price, 1),), bid, ask)
+        self.assertEqual(ask_volume + bid_volume, 1)
+        return "ask" if ask_volume else "bid"
+
+    def test_matches_old_ladder(self):
+        for price, bid, ask, side in SAME:
+            with self.subTest(price=price, bid=bid, ask=ask):
+                self.assertEqual(old_side(price, bid, ask), side)
+                self.assertEqual(self.side(price, bid, ask), side)
+
+    def test_documented_differences(self):
+        for price, bid, ask, old, new in CHANGED:
+            with self.subTest(price=price, bid=bid, ask=ask):
+                self.assertEqual(old_side(price, bid, ask), old)
+                self.assertEqual(self.side(price, bid, ask), new)
+
+    def test_sums_sizes_per_side(self):
+        trades = [(10.5, 100), (10.0, 40), (10.75, 7), (10.125, 3)]
+        self.assertEqual(classify_trades(trades, 10.0, 10.5), (107, 43))
+        self.assertEqual(classify_trades([], 10.0, 10.5), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
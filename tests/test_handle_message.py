@@ -0,0 +1,132 @@
+"""handle_message and decode_frame against an in-process stand-in for the
+shared block.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+import json
+import pathlib
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from feed import (
+    DROPPED_SIZE, LATENCY_SIZE, SLOT_SIZE, VolumeDeltaCalculator, VolumeDeltaView,
+    handle_message,
+)
+
+
+class Block:
+    # Just the .buf that the calculators and views use from SharedMemory.
+    def __init__(self, size):
+        self.buf = memoryview(bytearray(size))
+
+
+def quote(sym, bp=None, ap=None):
+    msg = {"ev": "Q", "sym": sym}
+    if bp is not None:
+        msg["bp"] = bp
+    if ap is not None:
+        msg["ap"] = ap
+    return msg
+
+
+def trade(sym, price, size):
+    return {"ev": "T", "sym": sym, "p": price, "s": size, "t": time.time_ns() // 1_000_000}
+
+
+class HandleMessageTest(unittest.TestCase):
+    TICKERS = ("AAA", "BBB")
+
+    def setUp(self):
+        latency_offset = len(self.TICKERS) * SLOT_SIZE
+        self.block = Block(latency_offset + LATENCY_SIZE + DROPPED_SIZE)
+        self.updated = threading.Event()
+        self.calculators = {
+            ticker: VolumeDeltaCalculator(self.block, i * SLOT_SIZE, self.updated)
+            for i, ticker in enumerate(self.TICKERS)
+        }
+        self.views = {
+            ticker: VolumeDeltaView(self.block, i * SLOT_SIZE, self.updated)
+            for i, ticker in enumerate(self.TICKERS)
+        }
+        self.latency = self.block.buf[latency_offset:latency_offset + LATENCY_SIZE].cast('I')
+        self.dropped = self.block.buf[latency_offset + LATENCY_SIZE:].cast('Q')
+
+    def tearDown(self):
+        self.latency.release()
+        self.dropped.release()
+
+    def send(self, *messages):
+        handle_message(json.dumps(messages).encode(), self.calculators, self.latency, self.dropped)
+
+    def send_raw(self, raw):
+        handle_message(raw, self.calculators, self.latency, self.dropped)
+
+    def totals(self, ticker):
+        # (volume_delta, ask_volume, bid_volume) as published to the UI side.
+        return self.views[ticker].get_volume_delta()
+
+    def test_trades_use_the_quote_in_effect_when_they_printed(self):
+        self.send(
+            quote("AAA", 10.0, 10.5), trade("AAA", 10.5, 100), trade("AAA", 10.0, 40),
+            quote("AAA", 20.0, 20.5), trade("AAA", 20.0, 7), trade("AAA", 20.5, 3),
+        )
+        self.assertEqual(self.views["AAA"].get_snapshot(), (56, 103, 47, 20.5))
+
+    def test_quote_carries_over_to_later_frames(self):
+        self.send(quote("AAA", 10.0, 10.5))
+        self.send(trade("AAA", 10.5, 5))
+        self.assertEqual(self.totals("AAA"), (5, 5, 0))
+
+    def test_trades_before_any_quote_set_price_only(self):
+        self.send(trade("AAA", 10.5, 5))
+        self.assertEqual(self.totals("AAA"), (0, 0, 0))
+        self.assertEqual(self.views["AAA"].get_last_price(), 10.5)
+
+    def test_one_sided_quote_keeps_the_last_two_sided_quote(self):
+        self.send(quote("AAA", 10.0, 10.5), quote("AAA", ap=11.0), trade("AAA", 10.5, 5))
+        self.send(quote("AAA", bp=10.4), trade("AAA", 10.0, 2))
+        self.assertEqual(self.totals("AAA"), (3, 5, 2))
+
+    def test_one_sided_quote_alone_is_not_a_quote(self):
+        self.send(quote("AAA", bp=10.0), trade("AAA", 10.0, 5))
+        self.assertEqual(self.totals("AAA"), (0, 0, 0))
+
+    def test_routes_by_symbol(self):
+        self.send(
+            quote("AAA", 10.0, 10.5), quote("BBB", 50.0, 50.5), quote("CCC", 1.0, 1.5),
+            trade("BBB", 50.0, 9), trade("AAA", 10.5, 4), trade("CCC", 1.5, 1000),
+        )
+        self.assertEqual(self.totals("AAA"), (4, 4, 0))
+        self.assertEqual(self.totals("BBB"), (-9, 0, 9))
+        self.assertEqual(sum(self.latency), 2)  # untracked trades are not timed
+
+    def test_quote_only_frame_does_not_publish(self):
+        self.send(quote("AAA", 10.0, 10.5))
+        self.assertFalse(self.updated.is_set())
+        self.send(trade("AAA", 10.5, 5), quote("AAA", 10.0, 10.5))
+        self.assertTrue(self.updated.is_set())
+
+    def test_bad_messages_drop_alone(self):
+        self.send(
+            quote("AAA", 10.0, 10.5),
+            {"ev": "A", "sym": "AAA"},                      # unknown event
+            {"ev": "T", "sym": "AAA", "s": 1, "t": 0},      # missing price
+            {"ev": "T", "sym": "AAA", "p": 10.5, "s": 1.5, "t": 0},  # fractional size
+            trade("AAA", 10.5, 7),
+        )
+        self.assertEqual(self.totals("AAA"), (7, 7, 0))
+        self.assertEqual(self.dropped[0], 3)
+
+    def test_unparsable_frame_is_dropped_whole(self):
+        self.send_raw(b"not json")
+        self.send_raw(b'{"ev": "T"}')
+        self.assertEqual(self.dropped[0], 2)
+        self.assertFalse(self.updated.is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+"""WS_CPU validation in load_config.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+import contextlib
+import io
+import os
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from feed import load_config
+
+ARGV = ["vd.py", "nvda", "aapl", "NVDA"]
+
+
+class LoadConfigTest(unittest.TestCase):
+    def load(self, ws_cpu):
+        with mock.patch.dict(os.environ, {"WS_CPU": ws_cpu}):
+            return load_config(ARGV)
+
+    def assert_exits(self, ws_cpu, message):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), self.assertRaises(SystemExit):
+            self.load(ws_cpu)
+        self.assertIn(message, out.getvalue())
+
+    def test_tickers_upper_cased_and_deduplicated(self):
+        self.assertEqual(self.load("").tickers, ("NVDA", "AAPL"))
+
+    def test_unset_ws_cpu(self):
+        self.assertIsNone(self.load("").ws_cpu)
+
+    @unittest.skipUnless(hasattr(os, "sched_getaffinity"), "Linux only")
+    def test_allowed_ws_cpu(self):
+        cpu = min(os.sched_getaffinity(0))
+        self.assertEqual(self.load(str(cpu)).ws_cpu, cpu)
+
+    @unittest.skipUnless(hasattr(os, "sched_setaffinity"), "Linux only")
+    def test_non_numeric_ws_cpu(self):
+        self.assert_exits("abc", "is not a CPU number")
+
+    @unittest.skipUnless(hasattr(os, "sched_getaffinity"), "Linux only")
+    def test_ws_cpu_outside_affinity(self):
+        self.assert_exits(str(max(os.sched_getaffinity(0)) + 1), "is not a CPU this process may run on")
+
+    def test_ws_cpu_without_affinity_support(self):
+        with mock.patch("feed.os", mock.Mock(wraps=os, spec=["getenv"])):
+            self.assert_exits("0", "only supported on Linux")
+
+
+if __name__ == "__main__":
+    unittest.main()